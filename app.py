@@ -1,180 +1,251 @@
-import streamlit as st
 import sys
 from pathlib import Path
-from dotenv import load_dotenv
-import sqlite3
-import pandas as pd
-
-# Load environment variables
-load_dotenv()
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Add project root to path
 sys.path.append(str(Path(__file__).parent))
 
-from utils.ocr import extract_text
-from models.classifier import classify_document
-from models.extractor import extract_entities
-from database.sqlite_db import init_db, insert_data, get_all_data
-from database.vector_db import store_embedding, search_documents
-
-# Initialize databases
-init_db()
-
-st.set_page_config(page_title="Property Document Processor", layout="wide")
-st.title("🏢 Property Management Document Processor")
+# Upper bound on documents processed concurrently (OCR and LLM calls are I/O bound)
+MAX_WORKERS = 8
 
-# Sidebar
-with st.sidebar:
-    st.header("📋 Menu")
-    page = st.radio("Navigate", ["Upload Documents", "Search Documents", "View Database"])
 
-# Page 1: Upload Documents
-if page == "Upload Documents":
-    st.header("📤 Upload Document")
+def main():
+    """
+    Streamlit page: upload and process documents, search them, browse the database
+    """
+    import streamlit as st
+    import sqlite3
+    import pandas as pd
+    from dotenv import load_dotenv
+    
+    # Load environment variables
+    load_dotenv()
+    
+    from utils.ocr import extract_text, OCRError
+    from models.extractor import classify_and_extract
+    from database.sqlite_db import COLS, init_db, insert_data_many, get_all_data
+    from database.vector_db import store_embeddings_batch, flush_embeddings, search_documents
     
-    uploaded_file = st.file_uploader(
-        "Upload Insurance, ID, or Invoice", 
-        type=['pdf', 'png', 'jpg', 'jpeg']
-    )
+    # Initialize databases
+    init_db()
     
-    if uploaded_file:
-        col1, col2 = st.columns(2)
+    def process_document(uploaded_file) -> dict:
+        """
+        Extract text, classify and extract entities for one uploaded file
+        Runs in a worker thread, so it must not call Streamlit
+        """
+        text = extract_text(uploaded_file)
+        result = classify_and_extract(text)
+        return {
+            'file': uploaded_file,
+            'text': text,
+            'doc_type': result['type'],
+            'entities': result['entities']
+        }
+    
+    @st.cache_data(ttl=30)
+    def cached_all_data(doc_type: str) -> pd.DataFrame:
+        """
+        Table contents for the View Database page, reused across reruns
+        Cleared whenever new documents are saved
+        """
+        return get_all_data(doc_type)
+    
+    st.set_page_config(page_title="Property Document Processor", layout="wide")
+    st.title("🏢 Property Management Document Processor")
+    
+    # Sidebar
+    with st.sidebar:
+        st.header("📋 Menu")
+        page = st.radio("Navigate", ["Upload Documents", "Search Documents", "View Database"])
+    
+    # Page 1: Upload Documents
+    if page == "Upload Documents":
+        st.header("📤 Upload Documents")
         
-        with col1:
-            st.subheader("📄 Document Preview")
-            if uploaded_file.type.startswith('image'):
-                st.image(uploaded_file, use_column_width=True)
-            else:
-                st.info("PDF uploaded - processing...")
+        uploaded_files = st.file_uploader(
+            "Upload Insurance, ID, or Invoice", 
+            type=['pdf', 'png', 'jpg', 'jpeg'],
+            accept_multiple_files=True
+        )
         
-        with col2:
-            st.subheader("🔄 Processing Status")
+        if uploaded_files:
+            processed = []
             
-            with st.spinner("Extracting text..."):
-                text = extract_text(uploaded_file)
-                st.success("✅ Text extracted")
-                with st.expander("View extracted text"):
-                    st.text(text[:1000] + "..." if len(text) > 1000 else text)
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(uploaded_files))) as executor:
+                futures = {executor.submit(process_document, f): f for f in uploaded_files}
+                
+                with st.spinner(f"Processing {len(uploaded_files)} document(s)..."):
+                    # Render each document as soon as its pipeline finishes
+                    for future in as_completed(futures):
+                        try:
+                            doc = future.result()
+                        except OCRError as e:
+                            st.divider()
+                            st.error(f"❌ {futures[future].name}: {e}")
+                            continue
+                        processed.append(doc)
+                        
+                        uploaded_file = doc['file']
+                        text = doc['text']
+                        doc_type = doc['doc_type']
+                        entities = doc['entities']
+                        
+                        st.divider()
+                        st.subheader(f"📎 {uploaded_file.name}")
+                        
+                        col1, col2 = st.columns(2)
+                        
+                        with col1:
+                            st.subheader("📄 Document Preview")
+                            if uploaded_file.type.startswith('image'):
+                                st.image(uploaded_file, use_column_width=True)
+                            else:
+                                st.info("PDF uploaded")
+                        
+                        with col2:
+                            st.subheader("🔄 Processing Status")
+                            
+                            st.success("✅ Text extracted")
+                            with st.expander("View extracted text"):
+                                st.text(text[:1000] + "..." if len(text) > 1000 else text)
+                            
+                            st.success(f"✅ Document Type: **{doc_type.upper()}**")
+                            st.success("✅ Entities extracted")
+                            
+                            # Show confidence score
+                            confidence = entities.get('confidence_score', 0)
+                            needs_review = entities.get('needs_review', False)
+                            
+                            col_a, col_b = st.columns(2)
+                            with col_a:
+                                if confidence >= 0.7:
+                                    st.success(f"Confidence: {confidence*100:.0f}%")
+                                else:
+                                    st.warning(f"Confidence: {confidence*100:.0f}%")
+                            
+                            with col_b:
+                                if needs_review:
+                                    st.error("⚠️ NEEDS HUMAN REVIEW")
+                                else:
+                                    st.success("✅ Auto-approved")
+                        
+                        # Display extracted data
+                        st.subheader("📊 Extracted Data")
+                        
+                        # Highlight review status
+                        if needs_review:
+                            st.warning("⚠️ This document requires human review due to low confidence in extraction.")
+                        
+                        st.json(entities)
             
-            with st.spinner("Classifying document..."):
-                doc_type = classify_document(text)
-                st.success(f"✅ Document Type: **{doc_type.upper()}**")
+            st.divider()
             
-            with st.spinner("Extracting entities..."):
-                entities = extract_entities(text, doc_type)
-                st.success("✅ Entities extracted")
-                
-                # Show confidence score
-                confidence = entities.get('confidence_score', 0)
-                needs_review = entities.get('needs_review', False)
-                
-                col_a, col_b = st.columns(2)
-                with col_a:
-                    if confidence >= 0.7:
-                        st.success(f"Confidence: {confidence*100:.0f}%")
-                    else:
-                        st.warning(f"Confidence: {confidence*100:.0f}%")
-                
-                with col_b:
-                    if needs_review:
-                        st.error("⚠️ NEEDS HUMAN REVIEW")
+            # Save to databases
+            if st.button("💾 Save to Database", type="primary"):
+                with st.spinner("Saving..."):
+                    # Save to SQLite, one batch per document type
+                    failed = 0
+                    for doc_type in {doc['doc_type'] for doc in processed} & COLS.keys():
+                        entities_list = [doc['entities'] for doc in processed if doc['doc_type'] == doc_type]
+                        if insert_data_many(doc_type, entities_list) != len(entities_list):
+                            failed += len(entities_list)
+                            st.error(f"❌ Failed to save {len(entities_list)} {doc_type} document(s) to the database")
+                    cached_all_data.clear()
+                    
+                    # Save to ChromaDB
+                    store_embeddings_batch(
+                        [doc['text'] for doc in processed],
+                        [doc['entities'] for doc in processed],
+                        [doc['doc_type'] for doc in processed]
+                    )
+                    flush_embeddings()
+                    
+                    saved = len(processed) - failed
+                    if saved:
+                        st.success(f"✅ {saved} document(s) saved successfully!")
+                    if not failed:
+                        st.balloons()
+    
+    # Page 2: Search Documents
+    elif page == "Search Documents":
+        st.header("🔍 Semantic Document Search")
+        
+        query = st.text_input("Enter search query", 
+                             placeholder="e.g., Find all invoices from HVAC vendors")
+        
+        n_results = st.slider("Number of results", 1, 10, 5)
+        
+        if st.button("Search", type="primary"):
+            if query:
+                with st.spinner("Searching..."):
+                    results = search_documents(query, n_results)
+                    
+                    if results and results['documents'][0]:
+                        st.subheader(f"Found {len(results['documents'][0])} results")
+                        
+                        for i, (doc, metadata) in enumerate(zip(results['documents'][0], 
+                                                                results['metadatas'][0])):
+                            with st.expander(f"Result {i+1} - {metadata.get('type', 'unknown').upper()}"):
+                                st.write("**Metadata:**")
+                                st.json(metadata)
+                                st.write("**Document Preview:**")
+                                st.text(doc[:500] + "..." if len(doc) > 500 else doc)
                     else:
-                        st.success("✅ Auto-approved")
+                        st.warning("No results found")
+            else:
+                st.warning("Please enter a search query")
+    
+    # Page 3: View Database
+    elif page == "View Database":
+        st.header("📊 Database Contents")
         
-        # Display extracted data
-        st.subheader("📊 Extracted Data")
+        tab1, tab2, tab3 = st.tabs(["Invoices", "Insurance", "IDs"])
         
-        # Highlight review status
-        if entities.get('needs_review'):
-            st.warning("⚠️ This document requires human review due to low confidence in extraction.")
+        with tab1:
+            st.subheader("📄 Invoices")
+            invoices = cached_all_data('invoice')
+            if not invoices.empty:
+                st.dataframe(invoices, width='stretch')
+                st.download_button(
+                    "Download CSV",
+                    invoices.to_csv(index=False),
+                    "invoices.csv",
+                    "text/csv"
+                )
+            else:
+                st.info("No invoices found")
         
-        st.json(entities)
+        with tab2:
+            st.subheader("🛡️ Insurance Policies")
+            insurance = cached_all_data('insurance')
+            if not insurance.empty:
+                st.dataframe(insurance, width='stretch')
+                st.download_button(
+                    "Download CSV",
+                    insurance.to_csv(index=False),
+                    "insurance.csv",
+                    "text/csv"
+                )
+            else:
+                st.info("No insurance records found")
         
-        # Save to databases
-        if st.button("💾 Save to Database", type="primary"):
-            with st.spinner("Saving..."):
-                # Save to SQLite
-                insert_data(doc_type, entities)
-                
-                # Save to ChromaDB
-                store_embedding(text, entities, doc_type)
-                
-                st.success("✅ Document saved successfully!")
-                st.balloons()
+        with tab3:
+            st.subheader("🪪 IDs")
+            ids = cached_all_data('id')
+            if not ids.empty:
+                st.dataframe(ids, width='stretch')
+                st.download_button(
+                    "Download CSV",
+                    ids.to_csv(index=False),
+                    "ids.csv",
+                    "text/csv"
+                )
+            else:
+                st.info("No ID records found")
 
-# Page 2: Search Documents
-elif page == "Search Documents":
-    st.header("🔍 Semantic Document Search")
-    
-    query = st.text_input("Enter search query", 
-                         placeholder="e.g., Find all invoices from HVAC vendors")
-    
-    n_results = st.slider("Number of results", 1, 10, 5)
-    
-    if st.button("Search", type="primary"):
-        if query:
-            with st.spinner("Searching..."):
-                results = search_documents(query, n_results)
-                
-                if results and results['documents'][0]:
-                    st.subheader(f"Found {len(results['documents'][0])} results")
-                    
-                    for i, (doc, metadata) in enumerate(zip(results['documents'][0], 
-                                                            results['metadatas'][0])):
-                        with st.expander(f"Result {i+1} - {metadata.get('type', 'unknown').upper()}"):
-                            st.write("**Metadata:**")
-                            st.json(metadata)
-                            st.write("**Document Preview:**")
-                            st.text(doc[:500] + "..." if len(doc) > 500 else doc)
-                else:
-                    st.warning("No results found")
-        else:
-            st.warning("Please enter a search query")
 
-# Page 3: View Database
-elif page == "View Database":
-    st.header("📊 Database Contents")
-    
-    tab1, tab2, tab3 = st.tabs(["Invoices", "Insurance", "IDs"])
-    
-    with tab1:
-        st.subheader("📄 Invoices")
-        invoices = get_all_data('invoice')
-        if not invoices.empty:
-            st.dataframe(invoices, width='stretch')
-            st.download_button(
-                "Download CSV",
-                invoices.to_csv(index=False),
-                "invoices.csv",
-                "text/csv"
-            )
-        else:
-            st.info("No invoices found")
-    
-    with tab2:
-        st.subheader("🛡️ Insurance Policies")
-        insurance = get_all_data('insurance')
-        if not insurance.empty:
-            st.dataframe(insurance, width='stretch')
-            st.download_button(
-                "Download CSV",
-                insurance.to_csv(index=False),
-                "insurance.csv",
-                "text/csv"
-            )
-        else:
-            st.info("No insurance records found")
-    
-    with tab3:
-        st.subheader("🪪 IDs")
-        ids = get_all_data('id')
-        if not ids.empty:
-            st.dataframe(ids, width='stretch')
-            st.download_button(
-                "Download CSV",
-                ids.to_csv(index=False),
-                "ids.csv",
-                "text/csv"
-            )
-        else:
-            st.info("No ID records found")
\ No newline at end of file
+# OCR worker processes (forkserver/spawn) re-run this script as __mp_main__ to set up their
+# __main__ module; they only need utils.ocr, so the models, databases and page load here only
+if __name__ != "__mp_main__":
+    main()
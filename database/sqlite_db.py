@@ -1,148 +1,193 @@
+import json
 import sqlite3
+import threading
 import pandas as pd
+import pyarrow as pa
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 
 DB_PATH = Path("data/property_data.db")
 
+# Create data directory if it doesn't exist
+DB_PATH.parent.mkdir(exist_ok=True)
+
+# Shared connection in autocommit mode; writes are grouped with _transaction()
+_conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+_conn.execute("PRAGMA journal_mode=WAL")
+_conn.execute("PRAGMA synchronous=NORMAL")
+_conn.execute("PRAGMA temp_store=MEMORY")
+_lock = threading.RLock()
+
+# SQLite's default limit on bound parameters per statement
+SQLITE_MAX_VARIABLES = 999
+
+# Table and insertable columns for each document type
+COLS = {
+    'invoice': ('invoices', (
+        'invoice_number', 'vendor_name', 'invoice_date', 'due_date',
+        'total_amount', 'subtotal', 'tax_amount', 'service_description',
+        'vendor_address', 'vendor_phone'
+    )),
+    'insurance': ('insurance', (
+        'policy_number', 'policyholder_name', 'insurance_company',
+        'policy_type', 'coverage_amount', 'premium_amount',
+        'effective_date', 'expiry_date', 'property_address', 'deductible'
+    )),
+    'id': ('ids', (
+        'document_type', 'id_number', 'full_name', 'date_of_birth',
+        'issue_date', 'expiry_date', 'address', 'state', 'country', 'gender'
+    ))
+}
+
+# Fixed single-row INSERT per document type, so sqlite3's statement cache reuses the compiled statement
+INSERT_SQL = {
+    doc_type: f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    for doc_type, (table_name, columns) in COLS.items()
+}
+
+
+@contextmanager
+def _transaction():
+    """
+    Run a block of statements in a single transaction on the shared connection
+    """
+    with _lock:
+        _conn.execute("BEGIN")
+        try:
+            yield _conn.cursor()
+            _conn.execute("COMMIT")
+        except Exception:
+            _conn.execute("ROLLBACK")
+            raise
+
+
 def init_db():
     """
     Initialize SQLite database with tables for invoices, insurance, and IDs
     """
-    # Create data directory if it doesn't exist
-    DB_PATH.parent.mkdir(exist_ok=True)
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Invoices table
-    c.execute('''CREATE TABLE IF NOT EXISTS invoices (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        invoice_number TEXT,
-        vendor_name TEXT,
-        invoice_date TEXT,
-        due_date TEXT,
-        total_amount REAL,
-        subtotal REAL,
-        tax_amount REAL,
-        service_description TEXT,
-        vendor_address TEXT,
-        vendor_phone TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Insurance table
-    c.execute('''CREATE TABLE IF NOT EXISTS insurance (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        policy_number TEXT,
-        policyholder_name TEXT,
-        insurance_company TEXT,
-        policy_type TEXT,
-        coverage_amount REAL,
-        premium_amount REAL,
-        effective_date TEXT,
-        expiry_date TEXT,
-        property_address TEXT,
-        deductible REAL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # IDs table
-    c.execute('''CREATE TABLE IF NOT EXISTS ids (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        document_type TEXT,
-        id_number TEXT,
-        full_name TEXT,
-        date_of_birth TEXT,
-        issue_date TEXT,
-        expiry_date TEXT,
-        address TEXT,
-        state TEXT,
-        country TEXT,
-        gender TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    conn.commit()
-    conn.close()
+    with _transaction() as c:
+        # Invoices table
+        c.execute('''CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_number TEXT,
+            vendor_name TEXT,
+            invoice_date TEXT,
+            due_date TEXT,
+            total_amount REAL,
+            subtotal REAL,
+            tax_amount REAL,
+            service_description TEXT,
+            vendor_address TEXT,
+            vendor_phone TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        
+        # Insurance table
+        c.execute('''CREATE TABLE IF NOT EXISTS insurance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            policy_number TEXT,
+            policyholder_name TEXT,
+            insurance_company TEXT,
+            policy_type TEXT,
+            coverage_amount REAL,
+            premium_amount REAL,
+            effective_date TEXT,
+            expiry_date TEXT,
+            property_address TEXT,
+            deductible REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        
+        # IDs table
+        c.execute('''CREATE TABLE IF NOT EXISTS ids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_type TEXT,
+            id_number TEXT,
+            full_name TEXT,
+            date_of_birth TEXT,
+            issue_date TEXT,
+            expiry_date TEXT,
+            address TEXT,
+            state TEXT,
+            country TEXT,
+            gender TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        
+        # Indexes for newest-first listings and lookups by document number
+        for table_name, _ in COLS.values():
+            c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_created_at ON {table_name} (created_at DESC)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_invoices_invoice_number ON invoices (invoice_number)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_insurance_policy_number ON insurance (policy_number)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ids_id_number ON ids (id_number)")
 
 
 def insert_data(doc_type: str, entities: dict):
     """
     Insert extracted entities into appropriate table
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+    if doc_type not in COLS:
+        return
+    
+    _, columns = COLS[doc_type]
+    params = _row(entities, columns)
     
     try:
-        if doc_type == 'invoice':
-            c.execute('''INSERT INTO invoices 
-                (invoice_number, vendor_name, invoice_date, due_date, 
-                 total_amount, subtotal, tax_amount, service_description,
-                 vendor_address, vendor_phone)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                (entities.get('invoice_number'),
-                 entities.get('vendor_name'),
-                 entities.get('invoice_date'),
-                 entities.get('due_date'),
-                 entities.get('total_amount'),
-                 entities.get('subtotal'),
-                 entities.get('tax_amount'),
-                 entities.get('service_description'),
-                 entities.get('vendor_address'),
-                 entities.get('vendor_phone'))
-            )
-        
-        elif doc_type == 'insurance':
-            c.execute('''INSERT INTO insurance 
-                (policy_number, policyholder_name, insurance_company, 
-                 policy_type, coverage_amount, premium_amount, 
-                 effective_date, expiry_date, property_address, deductible)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                (entities.get('policy_number'),
-                 entities.get('policyholder_name'),
-                 entities.get('insurance_company'),
-                 entities.get('policy_type'),
-                 entities.get('coverage_amount'),
-                 entities.get('premium_amount'),
-                 entities.get('effective_date'),
-                 entities.get('expiry_date'),
-                 entities.get('property_address'),
-                 entities.get('deductible'))
-            )
-        
-        elif doc_type == 'id':
-            c.execute('''INSERT INTO ids 
-                (document_type, id_number, full_name, date_of_birth,
-                 issue_date, expiry_date, address, state, country, gender)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                (entities.get('document_type'),
-                 entities.get('id_number'),
-                 entities.get('full_name'),
-                 entities.get('date_of_birth'),
-                 entities.get('issue_date'),
-                 entities.get('expiry_date'),
-                 entities.get('address'),
-                 entities.get('state'),
-                 entities.get('country'),
-                 entities.get('gender'))
-            )
-        
-        conn.commit()
-        
+        with _transaction() as c:
+            c.execute(INSERT_SQL[doc_type], params)
     except Exception as e:
         print(f"Error inserting data: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+
+
+def insert_data_many(doc_type: str, entities_list: list) -> int:
+    """
+    Insert several extracted entity dicts with multi-row INSERT statements
+    in a single transaction
+    Returns the number of rows inserted (0 if the transaction failed)
+    """
+    if doc_type not in COLS:
+        return 0
+    
+    table_name, columns = COLS[doc_type]
+    rows = [_row(entities, columns) for entities in entities_list]
+    if not rows:
+        return 0
+    
+    # Keep each statement under SQLite's bound-parameter limit
+    chunk_size = SQLITE_MAX_VARIABLES // len(columns)
+    row_placeholder = "(" + ", ".join("?" * len(columns)) + ")"
+    
+    try:
+        with _transaction() as c:
+            for i in range(0, len(rows), chunk_size):
+                batch = rows[i:i + chunk_size]
+                placeholders = ", ".join([row_placeholder] * len(batch))
+                c.execute(
+                    f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES {placeholders}",
+                    [value for row in batch for value in row]
+                )
+        return len(rows)
+    except Exception as e:
+        print(f"Error inserting data: {e}")
+        return 0
+
+
+def _row(entities: dict, columns: tuple) -> tuple:
+    """
+    Column values for one entity dict
+    Lists and dicts (e.g. from LLM output) are stored as JSON text, sqlite3 can't bind them
+    """
+    return tuple(
+        json.dumps(value) if isinstance(value, (list, dict)) else value
+        for value in (entities.get(col) for col in columns)
+    )
 
 
 def get_all_data(doc_type: str) -> pd.DataFrame:
     """
     Retrieve all data for a specific document type
     """
-    conn = sqlite3.connect(DB_PATH)
-    
     table_map = {
         'invoice': 'invoices',
         'insurance': 'insurance',
@@ -154,22 +199,35 @@ def get_all_data(doc_type: str) -> pd.DataFrame:
         return pd.DataFrame()
     
     try:
-        df = pd.read_sql_query(f"SELECT * FROM {table_name} ORDER BY created_at DESC", conn)
-        return df
+        with _lock:
+            c = _conn.execute(f"SELECT * FROM {table_name} ORDER BY created_at DESC")
+            rows = c.fetchall()
+        
+        # Build the frame column by column through Arrow instead of per-cell pandas conversion
+        columns = [description[0] for description in c.description]
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+        table = pa.table({name: _to_arrow(column) for name, column in zip(columns, values)})
+        return table.to_pandas()
     except Exception as e:
         print(f"Error retrieving data: {e}")
         return pd.DataFrame()
-    finally:
-        conn.close()
+
+
+def _to_arrow(values: tuple) -> pa.Array:
+    """
+    Convert a column of SQLite values to an Arrow array
+    Columns with mixed value types (e.g. text in a REAL column) become strings
+    """
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
 
 
 def get_record_by_id(doc_type: str, record_id: int) -> dict:
     """
     Get a specific record by ID
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
     table_map = {
         'invoice': 'invoices',
         'insurance': 'insurance',
@@ -181,8 +239,9 @@ def get_record_by_id(doc_type: str, record_id: int) -> dict:
         return {}
     
     try:
-        c.execute(f"SELECT * FROM {table_name} WHERE id = ?", (record_id,))
-        row = c.fetchone()
+        with _lock:
+            c = _conn.execute(f"SELECT * FROM {table_name} WHERE id = ?", (record_id,))
+            row = c.fetchone()
         
         if row:
             columns = [description[0] for description in c.description]
@@ -192,17 +251,12 @@ def get_record_by_id(doc_type: str, record_id: int) -> dict:
     except Exception as e:
         print(f"Error retrieving record: {e}")
         return {}
-    finally:
-        conn.close()
 
 
 def delete_record(doc_type: str, record_id: int):
     """
     Delete a record by ID
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
     table_map = {
         'invoice': 'invoices',
         'insurance': 'insurance',
@@ -214,12 +268,9 @@ def delete_record(doc_type: str, record_id: int):
         return False
     
     try:
-        c.execute(f"DELETE FROM {table_name} WHERE id = ?", (record_id,))
-        conn.commit()
+        with _transaction() as c:
+            c.execute(f"DELETE FROM {table_name} WHERE id = ?", (record_id,))
         return True
     except Exception as e:
         print(f"Error deleting record: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
\ No newline at end of file
+        return False
\ No newline at end of file
@@ -1,66 +1,312 @@
+import os
+import sqlite3
 import chromadb
+import numpy as np
+import streamlit as st
+import torch
 from sentence_transformers import SentenceTransformer
 from pathlib import Path
 import hashlib
+import threading
 from datetime import datetime
+from functools import lru_cache
+
+from database.sqlite_db import DB_PATH
+
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
 
 # Initialize paths
 CHROMA_PATH = Path("data/chroma_db")
 CHROMA_PATH.mkdir(parents=True, exist_ok=True)
 
-# Initialize embedding model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Embedding model device (GPU + FP16 when available, override with EMBED_DEVICE)
+device = os.getenv('EMBED_DEVICE') or ('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+@st.cache_resource
+def get_model() -> SentenceTransformer:
+    """
+    Load the embedding model once per process, surviving Streamlit reruns
+    """
+    model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+    if device.startswith('cuda'):
+        model.half()
+    return model
+
+
+@st.cache_resource
+def get_collection():
+    """
+    Open the ChromaDB collection once per process, surviving Streamlit reruns
+    """
+    client = chromadb.PersistentClient(path=str(CHROMA_PATH))
+    return client.get_or_create_collection(
+        name="documents",
+        metadata={"hnsw:space": "cosine"}
+    )
+
+
+# Pending writes, sent to ChromaDB in a single collection.upsert
+FLUSH_BATCH_SIZE = 256
+_pending = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+_pending_lock = threading.Lock()
+
+# Optional sqlite-vec KNN index in the SQLite database (ChromaDB stays the fallback)
+# The index stores int8-quantized vectors; candidates are re-ranked with the float32 embeddings
+USE_VEC_INDEX = os.getenv('USE_VEC_INDEX', '').lower() in ('1', 'true', 'yes')
+RERANK_OVERSAMPLE = 4
+BACKFILL_BATCH_SIZE = 1000
+
+# The index connection is shared by all Streamlit sessions
+_vec_lock = threading.RLock()
+
+
+@st.cache_resource
+def get_vec_conn():
+    """
+    Open the sqlite-vec index next to the SQLite tables
+    Returns None if the index is disabled or sqlite-vec is unavailable
+    """
+    if not USE_VEC_INDEX:
+        return None
+    
+    if sqlite_vec is None:
+        print("Warning: USE_VEC_INDEX set but sqlite-vec is not installed, using ChromaDB search")
+        return None
+    
+    try:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.enable_load_extension(True)
+        sqlite_vec.load(conn)
+        conn.enable_load_extension(False)
+        
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''CREATE TABLE IF NOT EXISTS vec_doc_ids (
+            rowid INTEGER PRIMARY KEY,
+            doc_id TEXT UNIQUE
+        )''')
+        conn.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS vec_docs USING vec0(
+            embedding int8[{get_model().get_sentence_embedding_dimension()}] distance_metric=cosine,
+            doc_type text
+        )''')
+        conn.commit()
+        
+        _vec_backfill(conn)
+        return conn
+        
+    except Exception as e:
+        print(f"Error initializing sqlite-vec index: {e}")
+        return None
+
+
+def _vec_backfill(vec_conn):
+    """
+    Copy documents stored in ChromaDB before the index was enabled into the index
+    """
+    collection = get_collection()
+    (indexed,) = vec_conn.execute("SELECT COUNT(*) FROM vec_doc_ids").fetchone()
+    if indexed >= collection.count():
+        return
+    
+    for offset in range(0, collection.count(), BACKFILL_BATCH_SIZE):
+        batch = collection.get(
+            include=["embeddings", "metadatas"],
+            limit=BACKFILL_BATCH_SIZE,
+            offset=offset
+        )
+        embeddings = np.asarray(batch["embeddings"], dtype=np.float32)
+        _vec_add(vec_conn, batch["ids"], embeddings, batch["metadatas"])
+
+
+def _vec_in_sync(vec_conn) -> bool:
+    """
+    Check that the index holds every ChromaDB document
+    """
+    with _vec_lock:
+        (indexed,) = vec_conn.execute("SELECT COUNT(*) FROM vec_doc_ids").fetchone()
+    return indexed >= get_collection().count()
 
-# Initialize ChromaDB client
-client = chromadb.PersistentClient(path=str(CHROMA_PATH))
-collection = client.get_or_create_collection(
-    name="documents",
-    metadata={"hnsw:space": "cosine"}
-)
 
 
 def generate_doc_id(text: str, doc_type: str) -> str:
     """
-    Generate unique document ID using hash
+    Generate a content-addressed document ID, so re-uploads map to the same ID
     """
-    content = f"{doc_type}_{text[:100]}_{datetime.now().isoformat()}"
-    return hashlib.md5(content.encode()).hexdigest()
+    content = f"{doc_type}|{text}"
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def _prepare_metadata(metadata: dict, doc_type: str) -> dict:
+    """
+    Build ChromaDB metadata for a document
+    """
+    meta = {
+        "type": doc_type,
+        "timestamp": datetime.now().isoformat(),
+        **metadata
+    }
+    
+    # Convert all metadata values to strings (ChromaDB requirement)
+    return {k: str(v) if v is not None else "" for k, v in meta.items()}
 
 
 def store_embedding(text: str, metadata: dict, doc_type: str):
     """
     Store document with embedding in ChromaDB
     """
+    doc_ids = store_embeddings_batch([text], [metadata], [doc_type])
+    return doc_ids[0] if doc_ids else None
+
+
+def store_embeddings_batch(texts: list, metadatas: list, doc_types: list):
+    """
+    Queue several documents for ChromaDB with a single batched encode
+    Pending documents are written once FLUSH_BATCH_SIZE is reached or on flush_embeddings()
+    """
     try:
-        # Generate embedding
-        embedding = model.encode(text).tolist()
+        # Generate all embeddings in one forward pass per batch
+        embeddings = get_model().encode(
+            texts,
+            batch_size=32,
+            convert_to_tensor=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype(np.float32, copy=False)
         
-        # Create document ID
-        doc_id = generate_doc_id(text, doc_type)
+        doc_ids = [generate_doc_id(text, doc_type) for text, doc_type in zip(texts, doc_types)]
+        metas = [_prepare_metadata(metadata, doc_type) for metadata, doc_type in zip(metadatas, doc_types)]
         
-        # Prepare metadata
-        meta = {
-            "type": doc_type,
-            "timestamp": datetime.now().isoformat(),
-            **metadata
-        }
+        with _pending_lock:
+            # A single upsert rejects repeated IDs, so queue each document once
+            queued = set(_pending["ids"])
+            for doc_id, embedding, text, meta in zip(doc_ids, embeddings, texts, metas):
+                if doc_id in queued:
+                    continue
+                queued.add(doc_id)
+                _pending["ids"].append(doc_id)
+                _pending["embeddings"].append(embedding)  # float32 row view, no Python float list
+                _pending["documents"].append(text)
+                _pending["metadatas"].append(meta)
+            should_flush = len(_pending["ids"]) >= FLUSH_BATCH_SIZE
         
-        # Convert all metadata values to strings (ChromaDB requirement)
-        meta = {k: str(v) if v is not None else "" for k, v in meta.items()}
+        if should_flush:
+            flush_embeddings()
         
-        # Store in ChromaDB
-        collection.add(
-            embeddings=[embedding],
-            documents=[text],
-            metadatas=[meta],
-            ids=[doc_id]
-        )
+        return doc_ids
         
-        return doc_id
+    except Exception as e:
+        print(f"Error storing embeddings: {e}")
+        return []
+
+
+def flush_embeddings() -> int:
+    """
+    Write all pending documents to ChromaDB
+    Returns the number of documents written
+    """
+    with _pending_lock:
+        count = len(_pending["ids"])
+        if not count:
+            return 0
         
+        try:
+            # Upsert so re-uploaded documents replace their entry instead of duplicating it
+            get_collection().upsert(**_pending)
+            vec_conn = get_vec_conn()
+            if vec_conn is not None:
+                _vec_add(vec_conn, _pending["ids"], _pending["embeddings"], _pending["metadatas"])
+            return count
+        except Exception as e:
+            print(f"Error flushing embeddings: {e}")
+            return 0
+        finally:
+            for values in _pending.values():
+                values.clear()
+
+
+def _quantize_int8(embedding: np.ndarray) -> np.ndarray:
+    """
+    Scalar-quantize a normalized embedding to int8
+    """
+    return np.clip(np.rint(embedding * 127), -127, 127).astype(np.int8)
+
+
+def _vec_add(vec_conn, doc_ids: list, embeddings: list, metadatas: list):
+    """
+    Mirror documents into the sqlite-vec index
+    """
+    try:
+        with _vec_lock, vec_conn:
+            for doc_id, embedding, meta in zip(doc_ids, embeddings, metadatas):
+                vec_conn.execute("INSERT OR IGNORE INTO vec_doc_ids (doc_id) VALUES (?)", (doc_id,))
+                (rowid,) = vec_conn.execute(
+                    "SELECT rowid FROM vec_doc_ids WHERE doc_id = ?", (doc_id,)
+                ).fetchone()
+                vec_conn.execute("DELETE FROM vec_docs WHERE rowid = ?", (rowid,))
+                vec_conn.execute(
+                    "INSERT INTO vec_docs (rowid, embedding, doc_type) VALUES (?, vec_int8(?), ?)",
+                    (rowid, _quantize_int8(embedding).tobytes(), meta["type"])
+                )
     except Exception as e:
-        print(f"Error storing embedding: {e}")
-        return None
+        print(f"Error updating sqlite-vec index: {e}")
+
+
+def _vec_search(vec_conn, query_embedding: np.ndarray, n_results: int, doc_type: str = None):
+    """
+    KNN search on the sqlite-vec index, shaped like a ChromaDB query result
+    Oversamples candidates from the int8 index and re-ranks them by exact float32 cosine distance
+    """
+    sql = '''SELECT m.doc_id
+        FROM vec_docs v JOIN vec_doc_ids m ON m.rowid = v.rowid
+        WHERE v.embedding MATCH vec_int8(?) AND k = ?'''
+    params = [_quantize_int8(query_embedding).tobytes(), n_results * RERANK_OVERSAMPLE]
+    if doc_type:
+        sql += " AND v.doc_type = ?"
+        params.append(doc_type)
+    
+    with _vec_lock:
+        doc_ids = [doc_id for (doc_id,) in vec_conn.execute(sql, params).fetchall()]
+    
+    empty = {"ids": [[]], "distances": [[]], "documents": [[]], "metadatas": [[]]}
+    if not doc_ids:
+        return empty
+    
+    found = get_collection().get(ids=doc_ids, include=["documents", "metadatas", "embeddings"])
+    if not found["ids"]:
+        return empty
+    
+    # Re-rank candidates with exact cosine distance
+    embeddings = np.asarray(found["embeddings"], dtype=np.float32)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    distances = 1.0 - embeddings @ query_embedding
+    order = np.argsort(distances)[:n_results]
+    
+    return {
+        "ids": [[found["ids"][i] for i in order]],
+        "distances": [[float(distances[i]) for i in order]],
+        "documents": [[found["documents"][i] for i in order]],
+        "metadatas": [[found["metadatas"][i] for i in order]]
+    }
+
+
+@lru_cache(maxsize=1024)
+def _embed_query(query: str) -> np.ndarray:
+    """
+    Embed a normalized search query (memoized for repeat queries)
+    """
+    embedding = get_model().encode(
+        query,
+        convert_to_tensor=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    ).astype(np.float32, copy=False)
+    
+    # Cached arrays are shared between callers
+    embedding.setflags(write=False)
+    return embedding
 
 
 def search_documents(query: str, n_results: int = 5, doc_type: str = None):
@@ -68,14 +314,26 @@ def search_documents(query: str, n_results: int = 5, doc_type: str = None):
     Search documents using semantic similarity
     """
     try:
-        # Generate query embedding
-        query_embedding = model.encode(query).tolist()
+        # Make queued documents visible to the search
+        flush_embeddings()
+        
+        # Generate query embedding (collapse whitespace so trivial variants share a cache entry)
+        query_embedding = _embed_query(" ".join(query.split()))
+        
+        # Only serve from the index while it covers every ChromaDB document
+        vec_conn = get_vec_conn()
+        if vec_conn is not None:
+            try:
+                if _vec_in_sync(vec_conn):
+                    return _vec_search(vec_conn, query_embedding, n_results, doc_type)
+            except Exception as e:
+                print(f"sqlite-vec search failed, falling back to ChromaDB: {e}")
         
         # Build where filter if doc_type specified
         where_filter = {"type": doc_type} if doc_type else None
         
         # Search
-        results = collection.query(
+        results = get_collection().query(
             query_embeddings=[query_embedding],
             n_results=n_results,
             where=where_filter
@@ -93,7 +351,7 @@ def get_all_documents():
     Retrieve all documents from ChromaDB
     """
     try:
-        results = collection.get()
+        results = get_collection().get()
         return results
     except Exception as e:
         print(f"Error retrieving documents: {e}")
@@ -105,7 +363,15 @@ def delete_document(doc_id: str):
     Delete a document by ID
     """
     try:
-        collection.delete(ids=[doc_id])
+        get_collection().delete(ids=[doc_id])
+        vec_conn = get_vec_conn()
+        if vec_conn is not None:
+            with _vec_lock, vec_conn:
+                vec_conn.execute(
+                    "DELETE FROM vec_docs WHERE rowid = (SELECT rowid FROM vec_doc_ids WHERE doc_id = ?)",
+                    (doc_id,)
+                )
+                vec_conn.execute("DELETE FROM vec_doc_ids WHERE doc_id = ?", (doc_id,))
         return True
     except Exception as e:
         print(f"Error deleting document: {e}")
@@ -117,6 +383,7 @@ def get_collection_stats():
     Get statistics about the collection
     """
     try:
+        collection = get_collection()
         count = collection.count()
         return {
             "total_documents": count,
@@ -1,9 +1,15 @@
-import os
-import requests
 from typing import Literal
 
-# Get API key from environment
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
+from models.llm_client import OPENROUTER_API_KEY, chat_completion
+
+VALID_TYPES = ('invoice', 'insurance', 'id', 'unknown')
+
+# Keywords for the rule-based fallback, by document type
+KEYWORDS = {
+    'invoice': ('invoice', 'bill', 'payment', 'amount due', 'vendor', 'total:', 'subtotal', 'remit to'),
+    'insurance': ('insurance', 'policy', 'coverage', 'premium', 'insured', 'policyholder', 'deductible', 'liability'),
+    'id': ('driver license', 'drivers license', 'passport', 'state id', 'identification', 'date of birth', 'license number', 'dl number', 'sex:', 'height:', 'eyes:')
+}
 
 
 def classify_document(text: str) -> Literal['invoice', 'insurance', 'id', 'unknown']:
@@ -40,36 +46,14 @@ Document text:
 Respond with ONLY the category name in lowercase, nothing else."""
 
     try:
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "google/gemini-2.0-flash-exp:free",  # Updated free model
-                # Alternative free models:
-                # "meta-llama/llama-3.2-3b-instruct:free"
-                # "qwen/qwen-2-7b-instruct:free"
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.1,
-                "max_tokens": 10
-            }
-        )
-        
-        response.raise_for_status()
-        result = response.json()
-        
-        classification = result['choices'][0]['message']['content'].strip().lower()
+        classification = chat_completion(
+            prompt,
+            max_tokens=10,
+            validate=lambda content: any(doc_type in content.lower() for doc_type in VALID_TYPES)
+        ).lower()
         
         # Validate response
-        valid_types = ['invoice', 'insurance', 'id', 'unknown']
-        for doc_type in valid_types:
+        for doc_type in VALID_TYPES:
             if doc_type in classification:
                 return doc_type
         
@@ -86,25 +70,13 @@ def fallback_classify(text: str) -> str:
     """
     text_lower = text.lower()
     
-    # Check for invoice keywords
-    invoice_keywords = ['invoice', 'bill', 'payment', 'amount due', 'vendor', 'total:', 'subtotal', 'remit to']
-    invoice_score = sum(1 for keyword in invoice_keywords if keyword in text_lower)
-    
-    # Check for insurance keywords
-    insurance_keywords = ['insurance', 'policy', 'coverage', 'premium', 'insured', 'policyholder', 'deductible', 'liability']
-    insurance_score = sum(1 for keyword in insurance_keywords if keyword in text_lower)
-    
-    # Check for ID keywords
-    id_keywords = ['driver license', 'drivers license', 'passport', 'state id', 'identification', 'date of birth', 'license number', 'dl number', 'sex:', 'height:', 'eyes:']
-    id_score = sum(1 for keyword in id_keywords if keyword in text_lower)
-    
-    # Return type with highest score
+    # Count keyword matches per document type
     scores = {
-        'invoice': invoice_score,
-        'insurance': insurance_score,
-        'id': id_score
+        doc_type: sum(1 for keyword in keywords if keyword in text_lower)
+        for doc_type, keywords in KEYWORDS.items()
     }
     
+    # Return type with highest score
     max_score = max(scores.values())
     if max_score >= 2:  # At least 2 keyword matches
         return max(scores, key=scores.get)
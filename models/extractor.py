@@ -1,11 +1,79 @@
-import os
-import requests
 import json
 import re
 from datetime import datetime
 
-# Get API key from environment
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
+from models.classifier import VALID_TYPES, classify_document
+from models.llm_client import OPENROUTER_API_KEY, chat_completion
+
+# Precompiled patterns for the regex fallback extractors
+INVOICE_NUMBER_RE = re.compile(r'invoice\s*#?\s*:?\s*(\S+)', re.IGNORECASE)
+VENDOR_NAME_RE = re.compile(r'(?:from|vendor)\s*:?\s*([^\n]+)', re.IGNORECASE)
+DUE_DATE_RE = re.compile(r'due\s+date\s*:?\s*([^\n]+)', re.IGNORECASE)
+
+POLICY_NUMBER_RE = re.compile(r'policy\s*#?\s*:?\s*(\S+)', re.IGNORECASE)
+POLICYHOLDER_RE = re.compile(r'(?:insured|policyholder)\s*:?\s*([^\n]+)', re.IGNORECASE)
+INSURANCE_COMPANY_RE = re.compile(r'(?:company|insurer)\s*:?\s*([^\n]+)', re.IGNORECASE)
+POLICY_EXPIRY_RE = re.compile(r'expir(?:y|ation)\s+date\s*:?\s*([^\n]+)', re.IGNORECASE)
+
+ID_NUMBER_RE = re.compile(r'(?:DL|ID|License|Passport)\s*#?\s*:?\s*(\S+)', re.IGNORECASE)
+FULL_NAME_RE = re.compile(r'name\s*:?\s*([^\n]+)', re.IGNORECASE)
+DATE_OF_BIRTH_RE = re.compile(r'(?:dob|date of birth)\s*:?\s*([^\n]+)', re.IGNORECASE)
+ISSUE_DATE_RE = re.compile(r'issue\s+date\s*:?\s*([^\n]+)', re.IGNORECASE)
+ID_EXPIRY_RE = re.compile(r'exp(?:iry)?\s+date\s*:?\s*([^\n]+)', re.IGNORECASE)
+ADDRESS_RE = re.compile(r'address\s*:?\s*([^\n]+)', re.IGNORECASE)
+STATE_RE = re.compile(r'state\s*:?\s*([A-Z]{2})', re.IGNORECASE)
+GENDER_RE = re.compile(r'sex\s*:?\s*([MF])', re.IGNORECASE)
+
+AMOUNT_RE = re.compile(r'\$\s*([\d,]+\.?\d*)')
+DATE_RES = [
+    re.compile(r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})', re.IGNORECASE),
+    re.compile(r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})', re.IGNORECASE),
+    re.compile(r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{4})', re.IGNORECASE)
+]
+PHONE_RE = re.compile(r'(\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4})')
+
+# Decoder used to pull JSON objects out of LLM responses
+_json_decoder = json.JSONDecoder()
+
+# JSON schemas requested from the LLM for each document type
+INVOICE_SCHEMA = """{
+  "invoice_number": "string or null",
+  "vendor_name": "string or null",
+  "invoice_date": "YYYY-MM-DD or null",
+  "due_date": "YYYY-MM-DD or null",
+  "total_amount": "number or null",
+  "subtotal": "number or null",
+  "tax_amount": "number or null",
+  "service_description": "string or null",
+  "vendor_address": "string or null",
+  "vendor_phone": "string or null"
+}"""
+
+INSURANCE_SCHEMA = """{
+  "policy_number": "string or null",
+  "policyholder_name": "string or null",
+  "insurance_company": "string or null",
+  "policy_type": "string or null",
+  "coverage_amount": "number or null",
+  "premium_amount": "number or null",
+  "effective_date": "YYYY-MM-DD or null",
+  "expiry_date": "YYYY-MM-DD or null",
+  "property_address": "string or null",
+  "deductible": "number or null"
+}"""
+
+ID_SCHEMA = """{
+  "document_type": "string (driver_license, passport, state_id) or null",
+  "id_number": "string or null",
+  "full_name": "string or null",
+  "date_of_birth": "YYYY-MM-DD or null",
+  "issue_date": "YYYY-MM-DD or null",
+  "expiry_date": "YYYY-MM-DD or null",
+  "address": "string or null",
+  "state": "string or null",
+  "country": "string or null",
+  "gender": "string or null"
+}"""
 
 
 def extract_entities(text: str, doc_type: str) -> dict:
@@ -23,7 +91,62 @@ def extract_entities(text: str, doc_type: str) -> dict:
     else:
         entities = {'error': 'Unknown document type'}
     
-    # Calculate confidence and add review flag
+    return add_review_flags(entities, doc_type)
+
+
+def classify_and_extract(text: str) -> dict:
+    """
+    Classify a document and extract its entities with a single OpenRouter call
+    Returns {'type': doc_type, 'entities': dict}
+    Falls back to separate classify_document/extract_entities calls if the combined response is unusable
+    """
+    
+    if OPENROUTER_API_KEY:
+        prompt = f"""You are a document processor for a property management company.
+
+Classify the following document into ONE of these categories and extract its fields:
+- invoice (vendor bills, payment requests)
+- insurance (renters insurance policies, coverage documents)
+- id (driver's license, passport, state ID, tenant identification)
+- unknown (if none of the above)
+
+Keys for invoice:
+{INVOICE_SCHEMA}
+
+Keys for insurance:
+{INSURANCE_SCHEMA}
+
+Keys for id:
+{ID_SCHEMA}
+
+Document:
+{text[:3000]}
+
+Return ONLY valid JSON of the form {{"type": "<category>", "entities": {{...}}}}, where entities uses the exact keys for the chosen category (empty object for unknown). No explanation or markdown formatting."""
+
+        content = call_openrouter(prompt, validate=is_combined_result)
+        
+        if content:
+            try:
+                result = parse_json_object(content)
+                if result is not None:
+                    doc_type = str(result.get('type', '')).strip().lower()
+                    if doc_type in ('invoice', 'insurance', 'id') and isinstance(result.get('entities'), dict):
+                        entities = clean_entities(result['entities'])
+                        return {'type': doc_type, 'entities': add_review_flags(entities, doc_type)}
+                    if doc_type == 'unknown':
+                        return {'type': doc_type, 'entities': extract_entities(text, doc_type)}
+            except Exception as e:
+                print(f"Error parsing combined classification JSON: {e}")
+    
+    doc_type = classify_document(text)
+    return {'type': doc_type, 'entities': extract_entities(text, doc_type)}
+
+
+def add_review_flags(entities: dict, doc_type: str) -> dict:
+    """
+    Add confidence score and human review flag to extracted entities
+    """
     confidence_score = calculate_confidence(entities, doc_type)
     entities['confidence_score'] = confidence_score
     entities['needs_review'] = confidence_score < 0.7  # Flag for human review if < 70%
@@ -72,34 +195,18 @@ def calculate_confidence(entities: dict, doc_type: str) -> float:
     return round(confidence, 2)
 
 
-def call_openrouter(prompt: str) -> str:
+def call_openrouter(prompt: str, validate=None) -> str:
     """
     Call OpenRouter API with prompt
+    Only responses passing validate (default: contains a JSON object) are cached
     """
     try:
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "google/gemini-2.0-flash-exp:free",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.1,
-                "max_tokens": 500
-            }
+        return chat_completion(
+            prompt,
+            max_tokens=500,
+            validate=validate or (lambda content: parse_json_object(content) is not None)
         )
         
-        response.raise_for_status()
-        result = response.json()
-        return result['choices'][0]['message']['content'].strip()
-        
     except Exception as e:
         print(f"OpenRouter API error: {e}")
         return None
@@ -116,18 +223,7 @@ def extract_invoice_entities(text: str) -> dict:
     
     prompt = f"""Extract the following information from this invoice document. Return ONLY valid JSON with these exact keys:
 
-{{
-  "invoice_number": "string or null",
-  "vendor_name": "string or null",
-  "invoice_date": "YYYY-MM-DD or null",
-  "due_date": "YYYY-MM-DD or null",
-  "total_amount": "number or null",
-  "subtotal": "number or null",
-  "tax_amount": "number or null",
-  "service_description": "string or null",
-  "vendor_address": "string or null",
-  "vendor_phone": "string or null"
-}}
+{INVOICE_SCHEMA}
 
 Document:
 {text[:3000]}
@@ -139,9 +235,8 @@ Return ONLY the JSON object, no explanation or markdown formatting."""
     if content:
         try:
             # Extract JSON from response (handle markdown code blocks)
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                entities = json.loads(json_match.group())
+            entities = parse_json_object(content)
+            if entities is not None:
                 return clean_entities(entities)
         except Exception as e:
             print(f"Error parsing invoice JSON: {e}")
@@ -160,18 +255,7 @@ def extract_insurance_entities(text: str) -> dict:
     
     prompt = f"""Extract the following information from this insurance document. Return ONLY valid JSON with these exact keys:
 
-{{
-  "policy_number": "string or null",
-  "policyholder_name": "string or null",
-  "insurance_company": "string or null",
-  "policy_type": "string or null",
-  "coverage_amount": "number or null",
-  "premium_amount": "number or null",
-  "effective_date": "YYYY-MM-DD or null",
-  "expiry_date": "YYYY-MM-DD or null",
-  "property_address": "string or null",
-  "deductible": "number or null"
-}}
+{INSURANCE_SCHEMA}
 
 Document:
 {text[:3000]}
@@ -182,9 +266,8 @@ Return ONLY the JSON object, no explanation or markdown formatting."""
     
     if content:
         try:
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                entities = json.loads(json_match.group())
+            entities = parse_json_object(content)
+            if entities is not None:
                 return clean_entities(entities)
         except Exception as e:
             print(f"Error parsing insurance JSON: {e}")
@@ -203,18 +286,7 @@ def extract_id_entities(text: str) -> dict:
     
     prompt = f"""Extract the following information from this ID document. Return ONLY valid JSON with these exact keys:
 
-{{
-  "document_type": "string (driver_license, passport, state_id) or null",
-  "id_number": "string or null",
-  "full_name": "string or null",
-  "date_of_birth": "YYYY-MM-DD or null",
-  "issue_date": "YYYY-MM-DD or null",
-  "expiry_date": "YYYY-MM-DD or null",
-  "address": "string or null",
-  "state": "string or null",
-  "country": "string or null",
-  "gender": "string or null"
-}}
+{ID_SCHEMA}
 
 Document:
 {text[:3000]}
@@ -225,9 +297,8 @@ Return ONLY the JSON object, no explanation or markdown formatting."""
     
     if content:
         try:
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                entities = json.loads(json_match.group())
+            entities = parse_json_object(content)
+            if entities is not None:
                 return clean_entities(entities)
         except Exception as e:
             print(f"Error parsing ID JSON: {e}")
@@ -235,6 +306,36 @@ Return ONLY the JSON object, no explanation or markdown formatting."""
     return fallback_extract_id(text)
 
 
+def parse_json_object(content: str) -> dict:
+    """
+    Parse the first JSON object embedded in an LLM response
+    Skips surrounding prose and markdown fences, returns None if no object is found
+    """
+    start = content.find('{')
+    while start != -1:
+        try:
+            # raw_decode stops at the end of the object, so trailing text is ignored
+            obj, _ = _json_decoder.raw_decode(content, start)
+            if isinstance(obj, dict):
+                return obj
+        except ValueError:
+            pass
+        start = content.find('{', start + 1)
+    return None
+
+
+def is_combined_result(content: str) -> bool:
+    """
+    Check that a combined classify-and-extract response has a known type and an entities object
+    """
+    result = parse_json_object(content)
+    return (
+        result is not None
+        and str(result.get('type', '')).strip().lower() in VALID_TYPES
+        and isinstance(result.get('entities'), dict)
+    )
+
+
 def clean_entities(entities: dict) -> dict:
     """
     Clean and validate extracted entities
@@ -253,11 +354,11 @@ def clean_entities(entities: dict) -> dict:
 def fallback_extract_invoice(text: str) -> dict:
     """Regex-based fallback for invoice extraction"""
     return {
-        'invoice_number': extract_pattern(text, r'invoice\s*#?\s*:?\s*(\S+)', re.IGNORECASE),
-        'vendor_name': extract_pattern(text, r'(?:from|vendor)\s*:?\s*([^\n]+)', re.IGNORECASE),
+        'invoice_number': extract_pattern(text, INVOICE_NUMBER_RE),
+        'vendor_name': extract_pattern(text, VENDOR_NAME_RE),
         'total_amount': extract_amount(text),
         'invoice_date': extract_date(text),
-        'due_date': extract_pattern(text, r'due\s+date\s*:?\s*([^\n]+)', re.IGNORECASE),
+        'due_date': extract_pattern(text, DUE_DATE_RE),
         'subtotal': None,
         'tax_amount': None,
         'service_description': None,
@@ -269,14 +370,14 @@ def fallback_extract_invoice(text: str) -> dict:
 def fallback_extract_insurance(text: str) -> dict:
     """Regex-based fallback for insurance extraction"""
     return {
-        'policy_number': extract_pattern(text, r'policy\s*#?\s*:?\s*(\S+)', re.IGNORECASE),
-        'policyholder_name': extract_pattern(text, r'(?:insured|policyholder)\s*:?\s*([^\n]+)', re.IGNORECASE),
-        'insurance_company': extract_pattern(text, r'(?:company|insurer)\s*:?\s*([^\n]+)', re.IGNORECASE),
+        'policy_number': extract_pattern(text, POLICY_NUMBER_RE),
+        'policyholder_name': extract_pattern(text, POLICYHOLDER_RE),
+        'insurance_company': extract_pattern(text, INSURANCE_COMPANY_RE),
         'policy_type': None,
         'coverage_amount': extract_amount(text),
         'premium_amount': None,
         'effective_date': extract_date(text),
-        'expiry_date': extract_pattern(text, r'expir(?:y|ation)\s+date\s*:?\s*([^\n]+)', re.IGNORECASE),
+        'expiry_date': extract_pattern(text, POLICY_EXPIRY_RE),
         'property_address': None,
         'deductible': None
     }
@@ -284,59 +385,54 @@ def fallback_extract_insurance(text: str) -> dict:
 
 def fallback_extract_id(text: str) -> dict:
     """Regex-based fallback for ID extraction"""
+    text_lower = text.lower()
     doc_type = 'unknown'
-    if 'driver' in text.lower() or 'license' in text.lower():
+    if 'driver' in text_lower or 'license' in text_lower:
         doc_type = 'driver_license'
-    elif 'passport' in text.lower():
+    elif 'passport' in text_lower:
         doc_type = 'passport'
-    elif 'state id' in text.lower():
+    elif 'state id' in text_lower:
         doc_type = 'state_id'
     
     return {
         'document_type': doc_type,
-        'id_number': extract_pattern(text, r'(?:DL|ID|License|Passport)\s*#?\s*:?\s*(\S+)', re.IGNORECASE),
-        'full_name': extract_pattern(text, r'name\s*:?\s*([^\n]+)', re.IGNORECASE),
-        'date_of_birth': extract_pattern(text, r'(?:dob|date of birth)\s*:?\s*([^\n]+)', re.IGNORECASE),
-        'issue_date': extract_pattern(text, r'issue\s+date\s*:?\s*([^\n]+)', re.IGNORECASE),
-        'expiry_date': extract_pattern(text, r'exp(?:iry)?\s+date\s*:?\s*([^\n]+)', re.IGNORECASE),
-        'address': extract_pattern(text, r'address\s*:?\s*([^\n]+)', re.IGNORECASE),
-        'state': extract_pattern(text, r'state\s*:?\s*([A-Z]{2})', re.IGNORECASE),
+        'id_number': extract_pattern(text, ID_NUMBER_RE),
+        'full_name': extract_pattern(text, FULL_NAME_RE),
+        'date_of_birth': extract_pattern(text, DATE_OF_BIRTH_RE),
+        'issue_date': extract_pattern(text, ISSUE_DATE_RE),
+        'expiry_date': extract_pattern(text, ID_EXPIRY_RE),
+        'address': extract_pattern(text, ADDRESS_RE),
+        'state': extract_pattern(text, STATE_RE),
         'country': None,
-        'gender': extract_pattern(text, r'sex\s*:?\s*([MF])', re.IGNORECASE)
+        'gender': extract_pattern(text, GENDER_RE)
     }
 
 
 # Helper functions
-def extract_pattern(text: str, pattern: str, flags=0) -> str:
-    """Extract first match of regex pattern"""
-    match = re.search(pattern, text, flags)
+def extract_pattern(text: str, pattern: re.Pattern) -> str:
+    """Extract first match of a precompiled regex pattern"""
+    match = pattern.search(text)
     return match.group(1).strip() if match else None
 
 
 def extract_amount(text: str) -> float:
     """Extract dollar amount"""
-    pattern = r'\$\s*([\d,]+\.?\d*)'
-    matches = re.findall(pattern, text)
-    if matches:
-        try:
-            # Get the largest amount found
-            amounts = [float(m.replace(',', '')) for m in matches]
-            return max(amounts)
-        except:
-            return None
-    return None
+    # Track the largest amount found in a single pass over the matches
+    best = None
+    try:
+        for match in AMOUNT_RE.finditer(text):
+            value = float(match.group(1).replace(',', ''))
+            if best is None or value > best:
+                best = value
+    except ValueError:
+        return None
+    return best
 
 
 def extract_date(text: str) -> str:
     """Extract date in various formats"""
-    patterns = [
-        r'(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})',
-        r'(\d{4}[-/]\d{1,2}[-/]\d{1,2})',
-        r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{4})'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in DATE_RES:
+        match = pattern.search(text)
         if match:
             return match.group(1)
     return None
@@ -344,6 +440,5 @@ def extract_date(text: str) -> str:
 
 def extract_phone(text: str) -> str:
     """Extract phone number"""
-    pattern = r'(\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4})'
-    match = re.search(pattern, text)
+    match = PHONE_RE.search(text)
     return match.group(1) if match else None
\ No newline at end of file
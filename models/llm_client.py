@@ -0,0 +1,66 @@
+import os
+import hashlib
+import diskcache
+import requests
+
+# Get API key from environment
+OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_MODEL = "google/gemini-2.0-flash-exp:free"
+# Alternative free models:
+# "meta-llama/llama-3.2-3b-instruct:free"
+# "qwen/qwen-2-7b-instruct:free"
+
+# Completed responses, keyed by request hash (re-uploads skip the API call)
+CACHE_TTL = 30 * 24 * 60 * 60
+_cache = diskcache.Cache("data/llm_cache")
+
+# Shared session so classification and extraction calls reuse pooled connections
+session = requests.Session()
+session.headers.update({
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json"
+})
+
+
+def chat_completion(prompt: str, max_tokens: int, temperature: float = 0.1, validate=None) -> str:
+    """
+    Send a single-message chat completion to OpenRouter
+    Returns the stripped response text, raises on HTTP errors
+    Usable responses (non-empty, and passing validate(content) if given) are cached,
+    so identical requests are only sent once
+    """
+    key = hashlib.blake2b(
+        f"{OPENROUTER_MODEL}|{max_tokens}|{temperature}|{prompt}".encode(),
+        digest_size=16
+    ).hexdigest()
+    
+    content = _cache.get(key)
+    if content is not None:
+        return content
+    
+    response = session.post(
+        url=OPENROUTER_URL,
+        json={
+            "model": OPENROUTER_MODEL,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        },
+        timeout=30
+    )
+    
+    response.raise_for_status()
+    result = response.json()
+    content = result['choices'][0]['message']['content'].strip()
+    
+    # Don't pin an empty or malformed reply, the next request gets a fresh answer
+    if content and (validate is None or validate(content)):
+        _cache.set(key, content, expire=CACHE_TTL)
+    return content
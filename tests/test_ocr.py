@@ -0,0 +1,29 @@
+import fitz
+import pytest
+
+from utils.ocr import _is_blank, _render_page
+
+
+def scanned_page(text: str = None) -> fitz.Page:
+    """
+    A4 page holding only an image, like scanner output, with an optional line of text
+    """
+    source = fitz.open()
+    page = source.new_page(width=595, height=842)
+    if text:
+        page.insert_text((72, 72), text, fontsize=11)
+    pix = page.get_pixmap(dpi=200, colorspace=fitz.csGRAY)
+    
+    doc = fitz.open()
+    scan = doc.new_page(width=595, height=842)
+    scan.insert_image(scan.rect, stream=pix.tobytes("png"))
+    return scan
+
+
+@pytest.mark.parametrize("text", ["Total: $500.00", "Approved", "Page 3"])
+def test_short_line_is_not_blank(text):
+    assert not _is_blank(_render_page(scanned_page(text)))
+
+
+def test_empty_page_is_blank():
+    assert _is_blank(_render_page(scanned_page()))
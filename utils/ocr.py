@@ -1,117 +1,578 @@
+import os
+import asyncio
+import logging
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageFilter
 import fitz  # PyMuPDF
+import numpy as np
 import io
+import hashlib
+import tempfile
+import queue
+import threading
+import multiprocessing
+import importlib.util
+import diskcache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator
+
+# Pages are OCR'd concurrently here, so each tesseract run gets one OpenMP thread
+# (parallelism is scaled with OCR_CONCURRENCY instead). All OCR runs in the worker pool, which sets
+# the limit in its environment (inherited by tesseract subprocesses); the app process keeps its
+# OpenMP threads for torch
+OMP_THREAD_LIMIT = "1"
+
+# pytesseract hands every image to tesseract through a temp file, keep those in RAM (tmpfs) when possible
+# An explicit TMPDIR wins, e.g. where /dev/shm is too small (Docker defaults to 64 MB)
+if not os.getenv("TMPDIR") and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+    tempfile.tempdir = "/dev/shm"
+
+# tesserocr is imported on first use, so OCR workers load libtesseract after their OpenMP limit is set
+HAS_TESSEROCR = importlib.util.find_spec("tesserocr") is not None
+
+log = logging.getLogger(__name__)
+
+
+class OCRError(Exception):
+    """
+    Text extraction failed (as opposed to a document with no text)
+    """
+
+
+# Tesseract settings: LSTM engine, automatic page segmentation for PDF pages,
+# a single text block (--psm 6) for uploaded images
+PDF_PAGE_CONFIG = '--oem 1 --psm 3'
+IMAGE_CONFIG = '--oem 1 --psm 6'
+
+# In-process Tesseract APIs (tesserocr), a pool of up to OCR_CONCURRENCY per page segmentation mode,
+# created lazily so each model is loaded once and threads OCR in parallel
+# Falls back to the pytesseract subprocess per call when tesserocr is not installed
+_api_pools = {}
+_api_lock = threading.Lock()
+
+# PDF pages with less embedded text than this are treated as scanned and OCR'd
+MIN_PAGE_TEXT = 20
+
+# Render zoom for an A4 page (~144 dpi), other page sizes are scaled to match
+OCR_ZOOM = 2.0
+A4_LONG_SIDE = 842  # points
+
+# Maximum pages OCR'd at the same time (OCR worker processes)
+OCR_CONCURRENCY = int(os.getenv('OCR_CONCURRENCY') or os.cpu_count() or 1)
+
+# Pages read (and OCR'd if needed) per step of extract_text_pages
+PAGE_WINDOW = 4 * OCR_CONCURRENCY
+
+# Rendered pages with fewer pixels darker than INK_LEVEL than this are treated as blank
+# Pages render at a fixed size (see compute_zoom), so a count works for any page size; it is set
+# far below a single short line (a lone "3" at 8pt is ~50 pixels), only pages with no ink are skipped
+INK_LEVEL = 200
+BLANK_INK_PIXELS = 20
+
+# A single embedded image covering at least this share of the page is OCR'd directly
+MIN_SCAN_COVERAGE = 0.95
+
+# Shared OCR worker pool, created on first use (see _get_executor)
+_executor = None
+_executor_lock = threading.Lock()
+
+# Extracted text by file content hash, so re-uploads skip extraction and OCR
+# Bump OCR_CACHE_VERSION whenever extraction output changes (preprocessing, Tesseract settings, page handling)
+CACHE_TTL = 30 * 24 * 60 * 60
+OCR_CACHE_VERSION = 4
+_cache = diskcache.Cache("data/ocr_cache")
+
 
 def extract_text(file) -> str:
     """
     Extract text from uploaded file (PDF or image)
+    Raises OCRError if extraction fails
     """
     
     file_type = file.type
     
     if 'pdf' in file_type:
-        return extract_text_from_pdf(file)
+        extractor = extract_text_from_pdf
     elif 'image' in file_type:
-        return extract_text_from_image(file)
+        extractor = extract_text_from_image
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
+    
+    data = file.read()
+    key = f"v{OCR_CACHE_VERSION}|{extractor.__name__}|{hashlib.blake2b(data, digest_size=16).hexdigest()}"
+    
+    text = _cache.get(key)
+    if text is not None:
+        return text
+    
+    # Failures raise OCRError, so only successful extractions are cached
+    text = extractor(data)
+    _cache.set(key, text, expire=CACHE_TTL)
+    return text
 
 
-def extract_text_from_pdf(file) -> str:
+def extract_text_from_pdf(pdf_bytes: bytes) -> str:
     """
     Extract text from PDF using PyMuPDF
+    Pages without a usable text layer are OCR'd individually
     """
     try:
-        # Read file bytes
-        pdf_bytes = file.read()
+        return "\n".join(extract_text_pages(pdf_bytes)).strip()
         
-        # Open PDF
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    except Exception as e:
+        log.exception("Error extracting text from PDF")
+        raise OCRError(f"Error extracting text from PDF: {e}") from e
+
+
+def extract_text_pages(pdf_bytes: bytes) -> Iterator[str]:
+    """
+    Yield the text of each PDF page in order
+    Pages are processed PAGE_WINDOW at a time, so memory stays bounded on large documents
+    """
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        yield from _pdf_page_texts(doc)
+
+
+def _pdf_page_texts(doc: fitz.Document, ocr_all: bool = False) -> Iterator[str]:
+    """
+    Yield the text of each page of an open PDF, OCR'ing scanned pages (or every page with ocr_all)
+    """
+    # One pool for the whole document
+    executor = _get_executor()
+    
+    # OCR of one window runs while the next window is read and rendered
+    previous = None
+    for start in range(0, len(doc), PAGE_WINDOW):
+        pages = list(doc.pages(start, min(start + PAGE_WINDOW, len(doc))))
         
-        text = ""
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text += page.get_text()
+        if ocr_all:
+            page_texts = [""] * len(pages)
+            ocr_slots = list(range(len(pages)))
+        else:
+            # Build each page's TextPage once and read plain text straight from it
+            # (same flags and clip as page.get_text(), so the output is unchanged)
+            page_texts = [
+                page.get_textpage(flags=fitz.TEXTFLAGS_TEXT, clip=page.rect).extractText()
+                for page in pages
+            ]
+            
+            # Only scanned pages need OCR, pages with embedded text keep it
+            ocr_slots = [j for j, text in enumerate(page_texts) if len(text.strip()) < MIN_PAGE_TEXT]
         
-        doc.close()
+        try:
+            submitted = _submit_pdf_pages([pages[j] for j in ocr_slots], executor)
+        except Exception as e:
+            raise OCRError(f"Error in PDF OCR: {e}") from e
         
-        # If no text extracted, try OCR on images
-        if len(text.strip()) < 50:
-            return extract_text_from_pdf_with_ocr(pdf_bytes)
+        if previous is not None:
+            yield from _finish_window(*previous, executor)
+        previous = (page_texts, ocr_slots, submitted)
+    
+    if previous is not None:
+        yield from _finish_window(*previous, executor)
+
+
+def _finish_window(page_texts: list, ocr_slots: list, submitted: list, executor: ProcessPoolExecutor) -> list:
+    """
+    Fill a window's scanned pages with their OCR text
+    """
+    try:
+        ocr_texts = _collect_pdf_pages(submitted, len(ocr_slots), executor)
+    except Exception as e:
+        raise OCRError(f"Error in PDF OCR: {e}") from e
+    
+    for j, text in zip(ocr_slots, ocr_texts):
+        page_texts[j] = text
+    return page_texts
+
+
+def extract_text_from_pdf_with_ocr(pdf_bytes: bytes = None, doc: fitz.Document = None) -> str:
+    """
+    Extract text from PDF using OCR (for scanned PDFs)
+    Pass an already-open doc to skip parsing the PDF again (it is left open)
+    """
+    try:
+        if doc is None:
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+                page_texts = list(_pdf_page_texts(doc, ocr_all=True))
+        else:
+            page_texts = list(_pdf_page_texts(doc, ocr_all=True))
         
-        return text.strip()
+        return "\n".join(page_texts).strip()
         
     except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
-        return ""
+        log.exception("Error in PDF OCR")
+        raise OCRError(f"Error in PDF OCR: {e}") from e
 
 
-def extract_text_from_pdf_with_ocr(pdf_bytes: bytes) -> str:
+def _submit_pdf_pages(pages: list, executor: ProcessPoolExecutor) -> list:
     """
-    Extract text from PDF using OCR (for scanned PDFs)
+    Render pages and queue the non-blank ones for OCR, in one contiguous batch per worker
+    Returns (future, slots) pairs, slots being positions in pages
+    """
+    submitted = []
+    if not pages:
+        return submitted
+    
+    batch_size = -(-len(pages) // OCR_CONCURRENCY)
+    
+    # Workers start on a batch as soon as it is rendered, so rendering overlaps OCR
+    # Rendering stays in this thread (fitz documents are not thread-safe and can't be sent to workers)
+    batch, batch_slots = [], []
+    for slot, page in enumerate(pages):
+        rendered = _render_page(page)
+        
+        # Blank pages stay empty without a trip through Tesseract
+        if not _is_blank(rendered):
+            batch.append(rendered)
+            batch_slots.append(slot)
+        
+        if batch and (len(batch) == batch_size or slot == len(pages) - 1):
+            submitted.append((executor.submit(_ocr_pages, batch), batch_slots))
+            batch, batch_slots = [], []
+    
+    return submitted
+
+
+def _collect_pdf_pages(submitted: list, page_count: int, executor: ProcessPoolExecutor) -> list:
     """
+    Wait for queued OCR batches, returns one text per page (blank pages stay empty)
+    """
+    page_texts = [""] * page_count
     try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        text = ""
+        for future, slots in submitted:
+            for slot, text in zip(slots, future.result()):
+                page_texts[slot] = text
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory), start a fresh pool for the next document
+        _discard_executor(executor)
+        raise
+    
+    return page_texts
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    The process pool shared by all OCR callers, at most OCR_CONCURRENCY workers in total
+    Workers come from a forkserver, forking the multi-threaded Streamlit/torch process is unsafe
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _executor = ProcessPoolExecutor(
+                max_workers=OCR_CONCURRENCY,
+                mp_context=multiprocessing.get_context(start_method),
+                initializer=_init_ocr_worker
+            )
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """
+    Drop a broken pool so the next caller creates a new one
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+async def extract_text_from_pdf_async(pdf_bytes: bytes) -> str:
+    """
+    Async variant of extract_text_from_pdf_with_ocr for callers running an event loop
+    Pages are rendered in threads and OCR'd in the worker pool, at most OCR_CONCURRENCY at a time
+    """
+    try:
+        doc = await asyncio.to_thread(fitz.open, stream=pdf_bytes, filetype="pdf")
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
+        # Pages are rendered inside the semaphore, so at most OCR_CONCURRENCY are in memory
+        render_lock = threading.Lock()
+        semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+        tasks = [
+            asyncio.ensure_future(_ocr_page_async(doc, i, render_lock, semaphore)) for i in range(len(doc))
+        ]
+        try:
+            page_texts = await asyncio.gather(*tasks)
+        finally:
+            # A failed page leaves the others running, stop them before the document goes away
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
             
-            # Convert page to image
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))  # 2x zoom for better OCR
-            img_bytes = pix.tobytes("png")
-            
-            # OCR the image
-            image = Image.open(io.BytesIO(img_bytes))
-            page_text = pytesseract.image_to_string(image)
-            text += page_text + "\n"
+            # A render thread can outlive its cancelled task, close only once it is done with the document
+            await asyncio.to_thread(_close_locked, doc, render_lock)
         
-        doc.close()
-        return text.strip()
+        return "\n".join(page_texts).strip()
         
     except Exception as e:
-        print(f"Error in PDF OCR: {e}")
-        return ""
+        log.exception("Error in PDF OCR")
+        raise OCRError(f"Error in PDF OCR: {e}") from e
 
 
-def extract_text_from_image(file) -> str:
+async def _ocr_page_async(doc: fitz.Document, page_number: int, render_lock: threading.Lock,
+                          semaphore: asyncio.Semaphore) -> str:
     """
-    Extract text from image using Tesseract OCR
+    Render one page in a thread and OCR it in the worker pool, bounded by the semaphore
     """
-    try:
-        # Open image
-        image = Image.open(file)
+    async with semaphore:
+        rendered = await asyncio.to_thread(_render_page_locked, doc, page_number, render_lock)
+        if _is_blank(rendered):
+            return ""
         
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        executor = _get_executor()
+        try:
+            page_texts = await asyncio.wrap_future(executor.submit(_ocr_pages, [rendered]))
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            raise
+    return page_texts[0]
+
+
+def _render_page_locked(doc: fitz.Document, page_number: int, render_lock: threading.Lock) -> tuple:
+    """
+    Render a page while holding the document's lock (fitz documents are not thread-safe)
+    """
+    with render_lock:
+        if doc.is_closed:
+            raise ValueError("document closed")
+        return _render_page(doc[page_number])
+
+
+def _close_locked(doc: fitz.Document, render_lock: threading.Lock):
+    """
+    Close a document once no page of it is being rendered
+    """
+    with render_lock:
+        doc.close()
+
+
+def _render_page(page: fitz.Page) -> tuple:
+    """
+    Render a page for OCR as (width, height, stride, samples) of an 8-bit grayscale pixmap
+    Raw samples go straight to PIL, no PNG encode/decode in between
+    """
+    # Scanner output is usually one image per page, decode it as-is instead of rasterizing
+    scan = _embedded_scan(page)
+    if scan is not None:
+        return scan
+    
+    zoom = compute_zoom(page)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    return (pix.width, pix.height, pix.stride, pix.samples)
+
+
+def _embedded_scan(page: fitz.Page):
+    """
+    Decode a page that is a single upright image covering the page, in the same form as _render_page
+    Returns None for any other page, or if the image is smaller than the page would render
+    Larger images are scaled down to the rendered size
+    """
+    images = page.get_images(full=True)
+    if len(images) != 1 or page.rotation:
+        return None
+    
+    xref, smask = images[0][0], images[0][1]
+    placements = page.get_image_rects(xref, transform=True)
+    if smask or len(placements) != 1:
+        return None
+    
+    # Placed without rotation or flipping, over (nearly) the whole page
+    rect, matrix = placements[0]
+    if matrix.b or matrix.c or matrix.a <= 0 or matrix.d <= 0:
+        return None
+    if rect.get_area() < MIN_SCAN_COVERAGE * page.rect.get_area():
+        return None
+    
+    # The raw samples ignore /Decode (e.g. inverted scans) and stencil masks, only rendering applies them
+    doc = page.parent
+    if doc.xref_get_key(xref, "Decode")[0] != "null" or doc.xref_get_key(xref, "ImageMask")[1] == "true":
+        return None
+    
+    try:
+        image = Image.open(io.BytesIO(doc.extract_image(xref)["image"]))
+        image = image.convert('L')
+    except Exception:
+        # Formats PIL can't decode (e.g. JBIG2) are rendered instead
+        return None
+    
+    target = compute_zoom(page) * max(page.rect.width, page.rect.height)
+    if max(image.size) < target:
+        return None
+    
+    # Keep OCR input at the same resolution a rendered page would have
+    if max(image.size) > target:
+        scale = target / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    
+    return (image.width, image.height, image.width, image.tobytes())
+
+
+def _is_blank(rendered: tuple) -> bool:
+    """
+    Check whether a rendered page has no ink (specks aside)
+    """
+    width, height, stride, samples = rendered
+    pixels = np.frombuffer(samples, dtype=np.uint8).reshape(height, stride)[:, :width]
+    return np.count_nonzero(pixels < INK_LEVEL) < BLANK_INK_PIXELS
+
+
+def compute_zoom(page: fitz.Page) -> float:
+    """
+    Render zoom for OCR, scaled by page size relative to A4
+    A4 renders at OCR_ZOOM, larger pages proportionally lower (clamped to 1-3x)
+    """
+    long_side = max(page.rect.width, page.rect.height) or A4_LONG_SIDE
+    return min(max(OCR_ZOOM * A4_LONG_SIDE / long_side, 1.0), 3.0)
+
+
+def _ocr_pages(rendered_pages: list) -> list:
+    """
+    OCR a batch of rendered PDF pages (runs in a worker process)
+    Each page is (width, height, stride, samples) of an 8-bit grayscale pixmap
+    """
+    images = [
+        preprocess_image(Image.frombuffer("L", (width, height), samples, "raw", "L", stride, 1))
+        for width, height, stride, samples in rendered_pages
+    ]
+    
+    # tesserocr keeps its model loaded between pages, pytesseract would start tesseract per page
+    if HAS_TESSEROCR or len(images) == 1:
+        return [_ocr(image) for image in images]
+    
+    return _ocr_batch_subprocess(images)
+
+
+def _ocr_batch_subprocess(images: list) -> list:
+    """
+    OCR several images with a single tesseract run over a list file
+    Returns one text per image
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for i, image in enumerate(images):
+            path = os.path.join(tmpdir, f"p{i}.png")
+            image.save(path)
+            paths.append(path)
         
-        # Perform OCR
-        text = pytesseract.image_to_string(image, config='--psm 6')
+        list_path = os.path.join(tmpdir, "list.txt")
+        with open(list_path, "w") as f:
+            f.write("\n".join(paths))
         
-        return text.strip()
+        output = pytesseract.image_to_string(list_path, config=PDF_PAGE_CONFIG)
+    
+    # tesseract ends every page with a form feed
+    page_texts = output.split("\f")
+    if len(page_texts) < len(images):
+        # Page boundaries lost, OCR the pages one by one instead
+        return [_ocr(image) for image in images]
+    return page_texts[:len(images)]
+
+
+def _init_ocr_worker():
+    """
+    OCR worker process initializer: limit OpenMP before tesserocr is loaded
+    """
+    os.environ.setdefault("OMP_THREAD_LIMIT", OMP_THREAD_LIMIT)
+
+
+def _ocr(image: Image.Image, single_block: bool = False) -> str:
+    """
+    OCR an image with the in-process Tesseract API, or pytesseract as a fallback (runs in a worker process)
+    single_block matches tesseract's --psm 6 (one uniform block of text)
+    """
+    if not HAS_TESSEROCR:
+        return pytesseract.image_to_string(image, config=IMAGE_CONFIG if single_block else PDF_PAGE_CONFIG)
+    
+    # Borrow an idle API, or a free slot (None) to create one in; blocks while all are busy
+    pool = _api_pool(single_block)
+    api = pool.get()
+    try:
+        # Load the model and settings once, later calls only set the image
+        if api is None:
+            from tesserocr import PyTessBaseAPI, PSM, OEM
+            api = PyTessBaseAPI(
+                psm=PSM.SINGLE_BLOCK if single_block else PSM.AUTO,
+                oem=OEM.LSTM_ONLY
+            )
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    finally:
+        pool.put(api)
+
+
+def _api_pool(single_block: bool) -> queue.Queue:
+    """
+    Pool of Tesseract APIs for one page segmentation mode, starting with OCR_CONCURRENCY empty slots
+    """
+    with _api_lock:
+        pool = _api_pools.get(single_block)
+        if pool is None:
+            pool = _api_pools[single_block] = queue.Queue()
+            for _ in range(OCR_CONCURRENCY):
+                pool.put(None)
+        return pool
+
+
+def extract_text_from_image(image_bytes: bytes) -> str:
+    """
+    Extract text from image using Tesseract OCR
+    """
+    try:
+        # Decoding and OCR run in the worker pool, like PDF pages
+        executor = _get_executor()
+        try:
+            return executor.submit(_ocr_image, image_bytes).result()
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            raise
         
     except Exception as e:
-        print(f"Error extracting text from image: {e}")
-        return ""
+        log.exception("Error extracting text from image")
+        raise OCRError(f"Error extracting text from image: {e}") from e
+
+
+def _ocr_image(image_bytes: bytes) -> str:
+    """
+    Decode, preprocess and OCR an uploaded image (runs in a worker process)
+    """
+    # Open image (preprocessing converts it to grayscale, not RGB)
+    image = Image.open(io.BytesIO(image_bytes))
+    
+    # Perform OCR
+    text = _ocr(preprocess_image(image), single_block=True)
+    
+    return text.strip()
 
 
 def preprocess_image(image: Image.Image) -> Image.Image:
     """
     Preprocess image for better OCR results
-    (Optional enhancement)
+    Grayscale, unsharp mask, then Otsu binarization to a 1-bit image
     """
-    from PIL import ImageEnhance, ImageFilter
-    
-    # Convert to grayscale
-    image = image.convert('L')
+    # Convert to grayscale and sharpen in PIL's C filters
+    if image.mode != 'L':
+        image = image.convert('L')
+    image = image.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=0))
     
-    # Enhance contrast
-    enhancer = ImageEnhance.Contrast(image)
-    image = enhancer.enhance(2)
+    # Binarize at the Otsu threshold, computed on the histogram with NumPy
+    arr = np.asarray(image)
+    return Image.fromarray(arr > _otsu_threshold(arr))
+
+
+def _otsu_threshold(arr: np.ndarray) -> int:
+    """
+    Gray level that maximizes the between-class variance of an 8-bit image
+    """
+    hist = np.bincount(arr.ravel(), minlength=256).astype(np.float64)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * np.arange(256))
+    total_weight, total_mean = weight[-1], mean[-1]
     
-    # Sharpen
-    image = image.filter(ImageFilter.SHARPEN)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (total_mean * weight - total_weight * mean) ** 2 / (weight * (total_weight - weight))
     
-    return image
\ No newline at end of file
+    return int(np.nanargmax(variance)) if np.isfinite(variance).any() else 127